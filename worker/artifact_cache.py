@@ -0,0 +1,124 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+from utils import evict_lru_files, get_artifact_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# keys are immutable git object ids, so entries never go stale; bump the version to drop
+# everything at once when the format of a cached artifact changes.
+ARTIFACT_CACHE_VERSION = "v1"
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+ARTIFACT_CACHE_MEMORY_ENTRIES = 1024
+_EVICT_EVERY_PUTS = 200
+# memory hits refresh the file's mtime at most this often, so eviction sees hot entries as recently used
+_TOUCH_INTERVAL_SECONDS = 60
+
+
+class ArtifactCache:
+    """Host-level cache of repo-derived artifacts shared by every agent, keyed by (kind, git sha).
+    Least recently read entries are evicted once the cache outgrows max_bytes."""
+
+    def __init__(self, root: str, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES):
+        self.root = os.path.join(root, ARTIFACT_CACHE_VERSION)
+        self.max_bytes = max_bytes
+        # value and the monotonic time its file's mtime was last refreshed
+        self._memory: OrderedDict[tuple[str, str], tuple[Any, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _path(self, kind: str, sha: str) -> str:
+        return os.path.join(self.root, kind, sha[:2], f"{sha}.json.gz")
+
+    def _remember(self, key: tuple[str, str], value: Any):
+        with self._lock:
+            self._memory[key] = (value, time.monotonic())
+            self._memory.move_to_end(key)
+            while len(self._memory) > ARTIFACT_CACHE_MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def get(self, kind: str, sha: str) -> Any | None:
+        key = (kind, sha)
+        path = self._path(kind, sha)
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                self._memory.move_to_end(key)
+                value, touched = cached
+                stale = time.monotonic() - touched > _TOUCH_INTERVAL_SECONDS
+                if stale:
+                    self._memory[key] = (value, time.monotonic())
+        if cached is not None:
+            if stale:
+                self._touch(path)
+            return value
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as exc:
+            logger.warning("dropping unreadable artifact %s: %s", path, exc)
+            self._discard(path)
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, kind: str, sha: str, value: Any):
+        self._remember((kind, sha), value)
+        path = self._path(kind, sha)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as exc:
+            logger.warning("failed to store artifact %s: %s", path, exc)
+            return
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % _EVICT_EVERY_PUTS == 0
+        if evict:
+            try:
+                self.evict()
+            except Exception as exc:
+                logger.warning("failed to evict artifacts: %s", exc)
+
+    def get_or_compute(self, kind: str, sha: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(kind, sha)
+        if value is None:
+            value = compute()
+            self.put(kind, sha, value)
+        return value
+
+    def evict(self):
+        evict_lru_files(self.root, self.max_bytes)
+
+    def _touch(self, path: str):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _discard(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_cache: ArtifactCache | None = None
+
+
+def get_artifact_cache() -> ArtifactCache:
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache(get_artifact_cache_dir())
+    return _cache
@@ -0,0 +1,84 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from utils import evict_lru_files, get_blob_dir, get_blob_path
+
+logger = logging.getLogger(__name__)
+
+BLOB_INLINE_LIMIT = int(os.getenv("BLOB_INLINE_LIMIT", "1000"))
+BLOB_PREVIEW_CHARS = 200
+BLOB_STORE_MAX_BYTES = int(os.getenv("BLOB_STORE_MAX_BYTES", str(5 * 1024 ** 3)))
+BLOB_MAX_AGE_SECONDS = float(os.getenv("BLOB_MAX_AGE_DAYS", "30")) * 24 * 60 * 60
+_EVICT_EVERY_PUTS = 200
+
+_puts = 0
+_puts_lock = threading.Lock()
+
+
+def evict_blobs():
+    """Blobs are only referenced from live and archived streams, so old or least recently used ones
+    are dropped; readers fall back to the inline preview once a blob is gone."""
+    evict_lru_files(get_blob_dir(), BLOB_STORE_MAX_BYTES, BLOB_MAX_AGE_SECONDS)
+
+
+def put_blob(text: str) -> str:
+    data = text.encode("utf-8")
+    sha = hashlib.sha256(data).hexdigest()
+    path = get_blob_path(sha)
+    if os.path.isfile(path):
+        # re-referenced content counts as recently used
+        os.utime(path)
+        return sha
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with gzip.open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    global _puts
+    with _puts_lock:
+        _puts += 1
+        evict = _puts % _EVICT_EVERY_PUTS == 0
+    if evict:
+        try:
+            evict_blobs()
+        except Exception as exc:
+            logger.warning("failed to evict blobs: %s", exc)
+    return sha
+
+
+def get_blob(sha: str) -> str | None:
+    if len(sha) != 64 or any(char not in "0123456789abcdef" for char in sha):
+        return None
+    path = get_blob_path(sha)
+    try:
+        with gzip.open(path, "rb") as f:
+            text = f.read().decode("utf-8")
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return text
+
+
+def inline_or_blob(text: str) -> tuple[str, str | None]:
+    """Returns (value, blob_sha). Text over BLOB_INLINE_LIMIT is stored once in the blob store and
+    only a short preview is kept inline."""
+    if len(text) <= BLOB_INLINE_LIMIT:
+        return text, None
+    try:
+        return text[:BLOB_PREVIEW_CHARS] + "...", put_blob(text)
+    except Exception as exc:
+        logger.warning("failed to store blob: %s", exc)
+        return text[:BLOB_INLINE_LIMIT] + "...", None
+
+
+def resolve_field(fields: dict, name: str) -> str:
+    if sha := fields.get(f"{name}_blob"):
+        try:
+            if (text := get_blob(sha)) is not None:
+                return text
+        except Exception as exc:
+            logger.warning("failed to load blob: %s", exc)
+    return fields.get(name, "")
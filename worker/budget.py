@@ -0,0 +1,159 @@
+import logging
+import os
+import time
+from dataclasses import dataclass, fields
+from langchain.agents.middleware import AgentMiddleware, ModelRequest
+from utils import get_stream_client
+
+logger = logging.getLogger(__name__)
+
+CANCEL_FLAG_TTL_SECONDS = 24 * 60 * 60
+CANCEL_POLL_SECONDS = 1.0
+
+_DELETE_IF_EQUAL_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def cancel_key(agent_id: int) -> str:
+    return f"agent:cancel:{agent_id}"
+
+
+def task_key(agent_id: int) -> str:
+    return f"agent:task:{agent_id}"
+
+
+class JobCancelled(Exception):
+    code = "cancelled"
+
+
+class BudgetExceeded(JobCancelled):
+    code = "budget_exceeded"
+
+
+@dataclass
+class JobBudget:
+    max_wall_seconds: float = float(os.getenv("JOB_MAX_WALL_SECONDS", "3600"))
+    max_tool_calls: int = int(os.getenv("JOB_MAX_TOOL_CALLS", "200"))
+    max_llm_tokens: int = int(os.getenv("JOB_MAX_LLM_TOKENS", "2000000"))
+    max_tool_bytes: int = int(os.getenv("JOB_MAX_TOOL_BYTES", str(20 * 1024 * 1024)))
+
+    @classmethod
+    def from_overrides(cls, overrides: dict | None) -> "JobBudget":
+        """Defaults with the given fields replaced; raises ValueError on anything but positive numbers."""
+        if overrides is not None and not isinstance(overrides, dict):
+            raise ValueError("budget must be an object")
+        budget = cls()
+        for field in fields(cls):
+            if overrides and overrides.get(field.name) is not None:
+                value = overrides[field.name]
+                try:
+                    value = field.type(value)
+                except (TypeError, ValueError, OverflowError):
+                    value = 0
+                if isinstance(overrides[field.name], bool) or not value > 0:
+                    raise ValueError(f"budget field {field.name} must be a positive number")
+                setattr(budget, field.name, value)
+        return budget
+
+
+class JobGuard:
+    """Tracks one job's usage against its budget and polls the agent's cancel flag."""
+
+    def __init__(self, agent_id: int, budget: JobBudget, task_id: str | None = None):
+        self.agent_id = agent_id
+        self.task_id = task_id
+        self.budget = budget
+        self.started = time.monotonic()
+        self.tool_calls = 0
+        self.llm_tokens = 0
+        self.tool_bytes = 0
+        self._last_poll = 0.0
+
+    def _cancel_requested(self) -> bool:
+        now = time.monotonic()
+        if now - self._last_poll < CANCEL_POLL_SECONDS:
+            return False
+        self._last_poll = now
+        try:
+            # the flag holds the id of the task being cancelled, so a stale flag never stops a later job
+            flagged = get_stream_client().get(cancel_key(self.agent_id))
+            return flagged is not None and (self.task_id is None or flagged == self.task_id)
+        except Exception as exc:
+            logger.warning("failed to poll cancel flag: %s", exc)
+            return False
+
+    def check(self):
+        if self._cancel_requested():
+            raise JobCancelled("agent cancelled by user")
+        if time.monotonic() - self.started > self.budget.max_wall_seconds:
+            raise BudgetExceeded(f"wall time budget of {self.budget.max_wall_seconds:.0f}s exceeded")
+        if self.llm_tokens > self.budget.max_llm_tokens:
+            raise BudgetExceeded(f"LLM token budget of {self.budget.max_llm_tokens} exceeded")
+        if self.tool_bytes > self.budget.max_tool_bytes:
+            raise BudgetExceeded(f"tool output budget of {self.budget.max_tool_bytes} bytes exceeded")
+
+    def check_tool_call(self):
+        """Runs before a tool call, so a budget of N allows exactly N calls."""
+        self.check()
+        if self.tool_calls >= self.budget.max_tool_calls:
+            raise BudgetExceeded(f"tool call budget of {self.budget.max_tool_calls} exceeded")
+
+    def record_tool(self, result_bytes: int):
+        self.tool_calls += 1
+        self.tool_bytes += result_bytes
+
+    def record_tokens(self, tokens: int):
+        self.llm_tokens += tokens
+
+
+def register_task(agent_id: int, task_id: str):
+    """Records the task only when none is registered; the endpoints register at enqueue time, and a
+    follow-up queued behind this job must stay the one /cancelAgent finds."""
+    try:
+        get_stream_client().set(task_key(agent_id), task_id, ex=CANCEL_FLAG_TTL_SECONDS, nx=True)
+    except Exception as exc:
+        logger.warning("failed to register agent task: %s", exc)
+
+
+def _delete_if_equal(key: str, value: str):
+    get_stream_client().eval(_DELETE_IF_EQUAL_SCRIPT, 1, key, value)
+
+
+def unregister_task(agent_id: int, task_id: str):
+    """Forgets the agent's task unless a newer one has been enqueued since."""
+    try:
+        _delete_if_equal(task_key(agent_id), task_id)
+    except Exception as exc:
+        logger.warning("failed to unregister agent task: %s", exc)
+
+
+def clear_cancel(agent_id: int, task_id: str):
+    try:
+        _delete_if_equal(cancel_key(agent_id), task_id)
+    except Exception as exc:
+        logger.warning("failed to clear cancel flag: %s", exc)
+
+
+class BudgetMiddleware(AgentMiddleware):
+    def __init__(self, guard: JobGuard):
+        super().__init__()
+        self.guard = guard
+
+    def wrap_model_call(self, request: ModelRequest, handler):
+        self.guard.check()
+        response = handler(request)
+        for message in getattr(response, "result", []):
+            if usage := getattr(message, "usage_metadata", None):
+                self.guard.record_tokens(usage.get("total_tokens", 0))
+        return response
+
+    def wrap_tool_call(self, request, handler):
+        self.guard.check_tool_call()
+        result = handler(request)
+        content = getattr(result, "content", result)
+        self.guard.record_tool(len(content if isinstance(content, str) else str(content)))
+        return result
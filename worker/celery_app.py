@@ -7,4 +7,10 @@ celery_app = Celery(
     broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"),
     backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/1"),
     include=["tasks.run_repo"]
-)
\ No newline at end of file
+)
+
+# agent tasks are acks_late, so an unacked task is redelivered once this expires; it must stay
+# well above the longest job (JOB_MAX_WALL_SECONDS) or a second worker resumes a job still running
+celery_app.conf.broker_transport_options = {
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", str(6 * 60 * 60))),
+}
@@ -0,0 +1,39 @@
+import logging
+import os
+import sqlite3
+from langgraph.checkpoint.sqlite import SqliteSaver
+from utils import get_checkpoint_path
+
+logger = logging.getLogger(__name__)
+
+
+def get_thread_id(agent_id: int, task_id: str | None) -> str:
+    return f"agent-{agent_id}-{task_id or 'local'}"
+
+
+def open_checkpointer(agent_id: int) -> SqliteSaver:
+    path = get_checkpoint_path(agent_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def has_checkpoint(checkpointer: SqliteSaver, thread_id: str) -> bool:
+    try:
+        return checkpointer.get_tuple({"configurable": {"thread_id": thread_id}}) is not None
+    except Exception as exc:
+        logger.warning("failed to read checkpoint: %s", exc)
+        return False
+
+
+def clear_checkpoint(checkpointer: SqliteSaver, thread_id: str):
+    try:
+        checkpointer.delete_thread(thread_id)
+    except Exception as exc:
+        logger.warning("failed to clear checkpoint: %s", exc)
+
+
+def close_checkpointer(checkpointer: SqliteSaver):
+    try:
+        checkpointer.conn.close()
+    except Exception as exc:
+        logger.warning("failed to close checkpointer: %s", exc)
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+from langchain.chat_models import init_chat_model
+from rate_limit import estimate_request_tokens, get_rate_limiter
+from utils import get_stream_client
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "12000"))
+HISTORY_KEEP_RECENT = int(os.getenv("HISTORY_KEEP_RECENT", "6"))
+# compaction folds the recent turns down to this, well under the budget, so follow-ups keep the same summary for a while
+HISTORY_COMPACT_TARGET = int(os.getenv("HISTORY_COMPACT_TARGET", str(HISTORY_TOKEN_BUDGET // 2)))
+SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-5-mini")
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and Codee, a coding agent.
+Given the existing summary and the next messages of the conversation, return an updated summary.
+Keep every user request, decision, file path, and outstanding task. Drop pleasantries and repetition.
+Respond with the summary only.
+"""
+
+
+def _summary_key(agent_id: int) -> str:
+    return f"history:summary:{agent_id}"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _to_chat_message(entry) -> dict:
+    if not isinstance(entry, dict):
+        return {"role": "user", "content": str(entry)}
+    sender = str(entry.get("sender") or entry.get("role") or "USER").upper()
+    content = entry.get("content")
+    if not isinstance(content, str):
+        content = json.dumps(content, default=str)
+    return {"role": "user" if sender == "USER" else "assistant", "content": content}
+
+
+def _load_summary(agent_id: int) -> tuple[int, str]:
+    try:
+        cached = get_stream_client().hgetall(_summary_key(agent_id))
+        return int(cached.get("count", 0)), cached.get("summary", "")
+    except Exception as exc:
+        logger.warning("failed to load history summary: %s", exc)
+        return 0, ""
+
+
+def _store_summary(agent_id: int, count: int, summary: str):
+    try:
+        get_stream_client().hset(_summary_key(agent_id), mapping={"count": count, "summary": summary})
+    except Exception as exc:
+        logger.warning("failed to store history summary: %s", exc)
+
+
+def _summarize(summary: str, messages: list[dict]) -> str:
+    transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    request = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNext messages:\n{transcript}"},
+    ]
+    model = init_chat_model(SUMMARY_MODEL)
+    response = get_rate_limiter().call(
+        lambda: model.invoke(request),
+        estimate_request_tokens([message["content"] for message in request]),
+    )
+    return str(response.text).strip()
+
+
+def _summary_message(summary: str) -> dict:
+    return {"role": "user", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+def _recent_to_keep(recent: list[dict]) -> int:
+    """Number of trailing messages to keep verbatim: as many as fit in HISTORY_COMPACT_TARGET,
+    at most HISTORY_KEEP_RECENT and never fewer than one."""
+    keep, used = 0, 0
+    for message in reversed(recent[-HISTORY_KEEP_RECENT:]):
+        used += estimate_tokens(message["content"])
+        if keep and used > HISTORY_COMPACT_TARGET:
+            break
+        keep += 1
+    return keep
+
+
+def compact_history(agent_id: int, previous_messages: list | None) -> list[dict]:
+    """Returns the conversation history as chat messages, folding older turns into a cached summary
+    once it no longer fits in HISTORY_TOKEN_BUDGET. Each compaction folds down to
+    HISTORY_COMPACT_TARGET, so the summary (and with it the history prefix) stays identical across
+    the follow-ups that refill the gap."""
+    history = [_to_chat_message(entry) for entry in previous_messages or []]
+    count, summary = _load_summary(agent_id)
+    if count > len(history):
+        count, summary = 0, ""
+
+    recent = history[count:]
+    total = estimate_tokens(summary) + sum(estimate_tokens(message["content"]) for message in recent)
+    keep = _recent_to_keep(recent)
+    if total > HISTORY_TOKEN_BUDGET and len(recent) > keep:
+        folded = recent[:len(recent) - keep]
+        try:
+            summary = _summarize(summary, folded)
+            count += len(folded)
+            recent = recent[len(folded):]
+            _store_summary(agent_id, count, summary)
+        except Exception as exc:
+            logger.warning("history summarization failed: %s", exc)
+
+    return ([_summary_message(summary)] if summary else []) + recent
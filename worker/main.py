@@ -1,10 +1,14 @@
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 import json
 import asyncio
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import redis.asyncio as redis
+from budget import CANCEL_FLAG_TTL_SECONDS, JobBudget, cancel_key, task_key
+from celery_app import celery_app
 from tasks.run_repo import pipeline, process_agent_message
+from blobs import get_blob
+from utils import load_archived_events
 from contextlib import asynccontextmanager
 
 REDIS_URL = "redis://localhost:6379/2"
@@ -45,6 +49,18 @@ async def stream(agent_id: str, request: Request, last_event_id: str | None = No
         nonlocal start_id
         seen_done = False
         try:
+            # the hot stream expires after a run finishes; late or resuming clients replay the archive
+            if start_id != "$" and not await r.exists(stream_key):
+                archived = await asyncio.to_thread(load_archived_events, agent_id, start_id)
+                for mid, fields in archived:
+                    start_id = mid
+                    event = fields.get("event", "message")
+                    data = {key: val for key, val in fields.items() if key != "event"}
+                    yield sse_pack(event, data, id=mid)
+                    if event == "done":
+                        seen_done = True
+                        break
+
             while not seen_done:
                 if await request.is_disconnected():
                     break
@@ -72,31 +88,71 @@ async def stream(agent_id: str, request: Request, last_event_id: str | None = No
     return StreamingResponse(event_generator(), media_type="text/event-stream", headers=headers)
 
 
+@app.get("/blobs/{sha}")
+async def blob(sha: str):
+    content = await asyncio.to_thread(get_blob, sha)
+    if content is None:
+        raise HTTPException(status_code=404, detail="blob not found")
+    return PlainTextResponse(content, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
 @app.get('/')
 async def root():
     return {
         "message": "codee"
     }
 
+def _validate_budget(budget):
+    # rejected here so a bad override fails the request instead of the queued job
+    try:
+        JobBudget.from_overrides(budget)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return budget
+
+
 @app.post("/newAgent")
 async def newAgent(agent_info: dict):
     tool_slugs = agent_info.get("tool_slugs") or []
+    budget = _validate_budget(agent_info.get("budget"))
     task = pipeline.delay(
         agent_info["repository_full_name"],
         agent_info["prompt"],
         agent_info["agent_id"],
         tool_slugs,
+        budget,
     )
+    # registered at enqueue time so a cancel can find and revoke the task before it starts
+    await app.state.redis.set(task_key(agent_info["agent_id"]), task.id, ex=CANCEL_FLAG_TTL_SECONDS)
     return {"task_id": task.id, "status": "queued"}
 
 
+@app.post("/cancelAgent")
+async def cancelAgent(agent_info: dict):
+    r: redis.Redis = app.state.redis
+    agent_id = agent_info["agent_id"]
+    task_id = agent_info.get("task_id") or await r.get(task_key(agent_id))
+    if not task_id:
+        return {"task_id": None, "status": "not_running"}
+    # a running job polls this flag between steps and tears down its sandbox; the value scopes it to this task
+    await r.set(cancel_key(agent_id), task_id, ex=CANCEL_FLAG_TTL_SECONDS)
+    # no terminate: killing the process would make the acks_late task redeliver and resume.
+    # a queued task is discarded by the worker, and the task_revoked handler closes out the agent
+    await asyncio.to_thread(celery_app.control.revoke, task_id)
+    return {"task_id": task_id, "status": "cancelling"}
+
+
 @app.post("/newMessage")
 async def newMessage(agent_info: dict):
     tool_slugs = agent_info.get("tool_slugs") or []
+    budget = _validate_budget(agent_info.get("budget"))
     task = process_agent_message.delay(
         agent_info["prompt"],
         agent_info["agent_id"],
         agent_info["previous_messages"],
         tool_slugs,
+        budget,
     )
+    # registered at enqueue time so a cancel can find and revoke the task before it starts
+    await app.state.redis.set(task_key(agent_info["agent_id"]), task.id, ex=CANCEL_FLAG_TTL_SECONDS)
     return {"task_id": task.id, "status": "queued"}
\ No newline at end of file
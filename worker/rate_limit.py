@@ -0,0 +1,255 @@
+import logging
+import os
+import random
+import time
+from typing import Any, Callable
+from langchain.agents.middleware import AgentMiddleware, ModelRequest
+from utils import emit_status, get_stream_client
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "500000"))
+LLM_OUTPUT_TOKEN_RESERVE = int(os.getenv("LLM_OUTPUT_TOKEN_RESERVE", "2000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "6"))
+LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", "600"))
+
+REQUESTS_BUCKET_KEY = "llm:limiter:rpm"
+TOKENS_BUCKET_KEY = "llm:limiter:tpm"
+METRICS_KEY = "llm:limiter:metrics"
+COOLDOWN_KEY = "llm:limiter:cooldown"
+# longest single sleep while queued, so the job's cancel flag and wall-time budget are checked during the wait
+_QUEUE_POLL_SECONDS = 1.0
+
+# refills every bucket from redis server time, then takes `cost` from all of them or none.
+# returns 0 when acquired, otherwise the milliseconds until the emptiest bucket has enough
+# (or until a provider cooldown set by _COOLDOWN_SCRIPT, the last key, runs out).
+_TOKEN_BUCKET_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[#KEYS])
+if cooldown > 0 then
+    return cooldown
+end
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local wait = 0
+local levels = {}
+for i = 1, #KEYS - 1 do
+    local key = KEYS[i]
+    local capacity = tonumber(ARGV[i * 2 - 1])
+    local cost = tonumber(ARGV[i * 2])
+    local rate = capacity / 60000
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now_ms
+    tokens = math.min(capacity, tokens + math.max(0, now_ms - ts) * rate)
+    levels[i] = tokens
+    if tokens < cost then
+        wait = math.max(wait, math.ceil((cost - tokens) / rate))
+    end
+end
+for i = 1, #KEYS - 1 do
+    local key = KEYS[i]
+    local tokens = levels[i]
+    if wait == 0 then
+        tokens = tokens - tonumber(ARGV[i * 2])
+    end
+    redis.call('HSET', key, 'tokens', tokens, 'ts', now_ms)
+    redis.call('PEXPIRE', key, 120000)
+end
+return wait
+"""
+
+# pauses every worker after a provider 429; only ever extends a cooldown already in place
+_COOLDOWN_SCRIPT = """
+if redis.call('PTTL', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], '1', 'PX', ARGV[1])
+end
+return 0
+"""
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+def _is_rate_limit_error(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status == 429 or "RateLimit" in type(exc).__name__
+
+
+def _backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    # full jitter: spreads retries from every worker across the window instead of bursting together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _cooldown_seconds(exc: Exception, attempt: int, cap: float = 60.0) -> float:
+    """Provider Retry-After when it sends one, otherwise the un-jittered backoff for this attempt."""
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return min(cap, float(headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return min(cap, 2 ** attempt)
+
+
+def _sleep(seconds: float, check: Callable[[], None] | None = None):
+    deadline = time.monotonic() + seconds
+    while (remaining := deadline - time.monotonic()) > 0:
+        if check:
+            check()
+        time.sleep(min(remaining, _QUEUE_POLL_SECONDS))
+
+
+def _record_metrics(**counters):
+    try:
+        pipe = get_stream_client().pipeline()
+        for field, value in counters.items():
+            if value:
+                pipe.hincrbyfloat(METRICS_KEY, field, value)
+        pipe.execute()
+    except Exception as exc:
+        logger.warning("failed to record limiter metrics: %s", exc)
+
+
+class LLMRateLimiter:
+    """Token-bucket limiter on requests and tokens per minute, shared by every worker through Redis."""
+
+    def __init__(
+        self,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._script = None
+        self._cooldown_script = None
+
+    def _try_acquire(self, tokens: int) -> int:
+        if self._script is None:
+            self._script = get_stream_client().register_script(_TOKEN_BUCKET_SCRIPT)
+        return int(self._script(
+            keys=[REQUESTS_BUCKET_KEY, TOKENS_BUCKET_KEY, COOLDOWN_KEY],
+            args=[self.requests_per_minute, 1, self.tokens_per_minute, min(tokens, self.tokens_per_minute)],
+        ))
+
+    def cool_down(self, seconds: float):
+        """Holds back every worker's requests for `seconds`, after the provider rate limited one of them."""
+        try:
+            if self._cooldown_script is None:
+                self._cooldown_script = get_stream_client().register_script(_COOLDOWN_SCRIPT)
+            self._cooldown_script(keys=[COOLDOWN_KEY], args=[max(1, int(seconds * 1000))])
+        except Exception as exc:
+            logger.warning("failed to set limiter cooldown: %s", exc)
+
+    def acquire(
+        self,
+        tokens: int,
+        agent_id: int | None = None,
+        check: Callable[[], None] | None = None,
+    ) -> float:
+        """Blocks until both buckets have capacity and returns the time spent queued, in seconds.
+        `check` runs between sleeps and may raise to abandon the wait (e.g. JobGuard.check)."""
+        started = time.monotonic()
+        notified = False
+        while True:
+            try:
+                wait_ms = self._try_acquire(tokens)
+            except Exception as exc:
+                logger.warning("rate limiter unavailable, proceeding without it: %s", exc)
+                wait_ms = 0
+            queued = time.monotonic() - started
+            if wait_ms <= 0:
+                return queued
+            if queued + wait_ms / 1000 > LLM_MAX_QUEUE_SECONDS:
+                raise RateLimitTimeout(f"waited {queued:.1f}s for LLM capacity")
+            if agent_id and not notified:
+                emit_status(agent_id, "running", step="llm_queued", detail="waiting for model capacity")
+                notified = True
+            _sleep(wait_ms / 1000 + random.uniform(0, 0.25), check)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int | None):
+        """Charges (or refunds) the difference between the estimate taken up front and actual usage."""
+        if not actual_tokens or actual_tokens == estimated_tokens:
+            return
+        try:
+            client = get_stream_client()
+            if client.exists(TOKENS_BUCKET_KEY):
+                client.hincrbyfloat(TOKENS_BUCKET_KEY, "tokens", estimated_tokens - actual_tokens)
+        except Exception as exc:
+            logger.warning("failed to settle limiter tokens: %s", exc)
+
+    def call(
+        self,
+        fn: Callable[[], Any],
+        estimated_tokens: int,
+        agent_id: int | None = None,
+        check: Callable[[], None] | None = None,
+    ) -> Any:
+        """Runs `fn` under the limiter, retrying provider rate-limit errors with jittered backoff.
+        A rate-limit error also sets a shared cooldown, so every worker backs off, not just this one."""
+        queued_total = 0.0
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            queued_total += self.acquire(estimated_tokens, agent_id=agent_id, check=check)
+            try:
+                result = fn()
+            except Exception as exc:
+                if not _is_rate_limit_error(exc) or attempt == LLM_MAX_RETRIES:
+                    _record_metrics(requests=1, failures=1, queued_ms=queued_total * 1000, retries=attempt)
+                    raise
+                self.cool_down(_cooldown_seconds(exc, attempt))
+                delay = _backoff_delay(attempt)
+                logger.info("provider rate limited (attempt %s), retrying in %.1fs", attempt + 1, delay)
+                _sleep(delay, check)
+                queued_total += delay
+                continue
+            _record_metrics(
+                requests=1,
+                throttled=1 if queued_total > 0.05 else 0,
+                queued_ms=queued_total * 1000,
+                retries=attempt,
+            )
+            if queued_total > 1:
+                logger.info("llm call queued for %.1fs", queued_total)
+            return result
+
+
+_limiter: LLMRateLimiter | None = None
+
+
+def get_rate_limiter() -> LLMRateLimiter:
+    global _limiter
+    if _limiter is None:
+        _limiter = LLMRateLimiter()
+    return _limiter
+
+
+def estimate_request_tokens(messages: list, system_prompt: str | None = None) -> int:
+    chars = len(system_prompt or "") + sum(len(str(getattr(message, "content", message))) for message in messages)
+    return chars // 4 + LLM_OUTPUT_TOKEN_RESERVE
+
+
+class RateLimitMiddleware(AgentMiddleware):
+    def __init__(
+        self,
+        agent_id: int,
+        limiter: LLMRateLimiter | None = None,
+        check: Callable[[], None] | None = None,
+    ):
+        super().__init__()
+        self.agent_id = agent_id
+        self.limiter = limiter or get_rate_limiter()
+        self.check = check
+
+    def wrap_model_call(self, request: ModelRequest, handler):
+        estimated = estimate_request_tokens(request.messages, request.system_prompt)
+        response = self.limiter.call(
+            lambda: handler(request),
+            estimated,
+            agent_id=self.agent_id,
+            check=self.check,
+        )
+        usage = next(
+            (getattr(message, "usage_metadata", None) for message in reversed(getattr(response, "result", []))),
+            None,
+        )
+        self.limiter.settle(estimated, (usage or {}).get("total_tokens"))
+        return response
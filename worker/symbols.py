@@ -0,0 +1,259 @@
+import ast
+import logging
+import os
+import re
+import threading
+from dulwich.objects import Blob
+from dulwich.repo import Repo
+from artifact_cache import get_artifact_cache
+from utils import get_workspace_path
+
+logger = logging.getLogger(__name__)
+
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+# part of the artifact cache key; bump whenever extraction changes so cached symbols are recomputed
+SYMBOLS_VERSION = 2
+
+_IDENT = r"[A-Za-z_$][\w$]*"
+_JS_PATTERNS = [
+    ("class", rf"^\s*(?:export\s+)?(?:default\s+)?(?:abstract\s+)?class\s+({_IDENT})"),
+    ("function", rf"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?function\s*\*?\s*({_IDENT})"),
+    ("variable", rf"^(?:export\s+)?(?:const|let|var)\s+({_IDENT})\s*[=:]"),
+    ("interface", rf"^\s*(?:export\s+)?interface\s+({_IDENT})"),
+    ("type", rf"^\s*(?:export\s+)?type\s+({_IDENT})\s*[=<]"),
+    ("enum", rf"^\s*(?:export\s+)?(?:const\s+)?enum\s+({_IDENT})"),
+]
+_JS_MODIFIERS = r"(?:(?:public|private|protected|static|readonly|override|abstract|declare|async|get|set)\s+)*"
+# members directly inside a class body: `name(`, `async *name<T>(`, `name = (..) =>`, `name = async x =>`
+_JS_MEMBER_PATTERNS = [
+    re.compile(rf"^\s*{_JS_MODIFIERS}\*?\s*(#?{_IDENT})\s*\??\s*(?:<[^>]*>)?\s*\("),
+    re.compile(rf"^\s*{_JS_MODIFIERS}(#?{_IDENT})\s*\??\s*(?::[^=]+)?=\s*(?:async\s+)?(?:\([^)]*\)|{_IDENT})\s*(?::[^=]+)?=>"),
+]
+_JS_NOT_MEMBERS = {"if", "for", "while", "switch", "catch", "return", "function", "super", "new", "await"}
+_JS_STRING = re.compile(r"'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|`(?:\\.|[^`\\])*`")
+_JS_EXTENSIONS = {".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx"}
+
+_REGEX_PATTERNS: dict[str, list[tuple[str, str]]] = {
+    ".go": [
+        ("function", r"^func\s+(?:\([^)]*\)\s*)?(\w+)"),
+        ("type", r"^type\s+(\w+)"),
+    ],
+    ".rs": [
+        ("function", r"^\s*(?:pub(?:\([^)]*\))?\s+)?(?:async\s+)?(?:unsafe\s+)?fn\s+(\w+)"),
+        ("struct", r"^\s*(?:pub(?:\([^)]*\))?\s+)?struct\s+(\w+)"),
+        ("enum", r"^\s*(?:pub(?:\([^)]*\))?\s+)?enum\s+(\w+)"),
+        ("trait", r"^\s*(?:pub(?:\([^)]*\))?\s+)?trait\s+(\w+)"),
+        ("type", r"^\s*(?:pub(?:\([^)]*\))?\s+)?type\s+(\w+)"),
+    ],
+    ".java": [
+        ("class", r"^\s*(?:(?:public|private|protected|abstract|final|static)\s+)*(?:class|interface|enum|record)\s+(\w+)"),
+    ],
+    ".rb": [
+        ("class", r"^\s*(?:class|module)\s+([A-Z]\w*)"),
+        ("function", r"^\s*def\s+(?:self\.)?(\w+[?!=]?)"),
+    ],
+    ".c": [("function", r"^[A-Za-z_][\w\s\*]*?\b(\w+)\s*\([^;]*$")],
+    ".h": [("function", r"^[A-Za-z_][\w\s\*]*?\b(\w+)\s*\([^;]*$"), ("type", r"^typedef\s.*?(\w+)\s*;")],
+}
+_COMPILED_PATTERNS = {
+    ext: [(kind, re.compile(pattern)) for kind, pattern in patterns]
+    for ext, patterns in _REGEX_PATTERNS.items()
+}
+_PYTHON_FALLBACK = [
+    ("class", re.compile(r"^\s*class\s+(\w+)")),
+    ("function", re.compile(r"^\s*(?:async\s+)?def\s+(\w+)")),
+]
+
+
+def _symbol(name: str, kind: str, line: int, scope: str = "") -> dict:
+    return {"name": name, "kind": kind, "line": line, "qualname": f"{scope}.{name}" if scope else name}
+
+
+def _python_symbols(text: str) -> list[dict]:
+    symbols = []
+
+    def visit(body: list, scope: str, in_class: bool):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                symbols.append(_symbol(node.name, "class", node.lineno, scope))
+                visit(node.body, f"{scope}.{node.name}" if scope else node.name, True)
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                symbols.append(_symbol(node.name, "method" if in_class else "function", node.lineno, scope))
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)):
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name):
+                        symbols.append(_symbol(target.id, "variable", node.lineno, scope))
+
+    visit(ast.parse(text).body, "", False)
+    return symbols
+
+
+def _regex_symbols(text: str, patterns: list[tuple[str, re.Pattern]]) -> list[dict]:
+    symbols = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        for kind, pattern in patterns:
+            if match := pattern.match(line):
+                symbols.append(_symbol(match.group(1), kind, lineno))
+                break
+    return symbols
+
+
+def _js_symbols(text: str) -> list[dict]:
+    """Top-level declarations by line regex, plus class members, found by tracking brace depth so
+    only lines directly inside a class body are tried as methods."""
+    top_level = [(kind, re.compile(pattern)) for kind, pattern in _JS_PATTERNS]
+    symbols = []
+    classes: list[tuple[str, int]] = []
+    pending_class = None
+    depth = 0
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        if classes and depth == classes[-1][1]:
+            for pattern in _JS_MEMBER_PATTERNS:
+                if (match := pattern.match(line)) and match.group(1) not in _JS_NOT_MEMBERS:
+                    symbols.append(_symbol(match.group(1), "method", lineno, classes[-1][0]))
+                    break
+        else:
+            for kind, pattern in top_level:
+                if match := pattern.match(line):
+                    symbols.append(_symbol(match.group(1), kind, lineno))
+                    if kind == "class":
+                        pending_class = match.group(1)
+                    break
+
+        code = _JS_STRING.sub("", line).split("//", 1)[0]
+        for char in code:
+            if char == "{":
+                depth += 1
+                if pending_class:
+                    classes.append((pending_class, depth))
+                    pending_class = None
+            elif char == "}":
+                depth -= 1
+                while classes and depth < classes[-1][1]:
+                    classes.pop()
+    return symbols
+
+
+def is_indexable(path: str) -> bool:
+    ext = os.path.splitext(path)[1]
+    return ext == ".py" or ext in _JS_EXTENSIONS or ext in _COMPILED_PATTERNS
+
+
+def extract_symbols(path: str, text: str) -> list[dict]:
+    ext = os.path.splitext(path)[1]
+    if ext == ".py":
+        try:
+            return _python_symbols(text)
+        except (SyntaxError, ValueError):
+            return _regex_symbols(text, _PYTHON_FALLBACK)
+    if ext in _JS_EXTENSIONS:
+        return _js_symbols(text)
+    if patterns := _COMPILED_PATTERNS.get(ext):
+        return _regex_symbols(text, patterns)
+    return []
+
+
+class SymbolIndex:
+    """Definitions per tracked file of one workspace, with a name lookup on top."""
+
+    def __init__(self, agent_path: str):
+        self.agent_path = agent_path
+        self.files: dict[str, list[dict]] = {}
+        self.tracked: set[str] = set()
+        self._by_name: dict[str, list[tuple[str, dict]]] = {}
+        self._lock = threading.Lock()
+
+    def set_file(self, path: str, symbols: list[dict]):
+        with self._lock:
+            for symbol in self.files.pop(path, []):
+                for key in {symbol["name"], symbol["qualname"]}:
+                    self._by_name[key] = [match for match in self._by_name.get(key, []) if match[0] != path]
+            self.files[path] = symbols
+            for symbol in symbols:
+                for key in {symbol["name"], symbol["qualname"]}:
+                    self._by_name.setdefault(key, []).append((path, symbol))
+
+    def resolve_path(self, path: str) -> str | None:
+        """Absolute path of a workspace file, or None when path (after symlinks) leaves the workspace."""
+        root = os.path.realpath(self.agent_path)
+        full_path = os.path.realpath(os.path.join(root, path))
+        return full_path if os.path.commonpath([root, full_path]) == root else None
+
+    def definitions(self, name: str) -> list[tuple[str, dict]]:
+        with self._lock:
+            return list(self._by_name.get(name, []))
+
+
+def _cache_kind(path: str) -> str:
+    # symbols depend on the extractor as well as the content, so its version and the extension are part of the kind
+    return f"symbols-v{SYMBOLS_VERSION}{os.path.splitext(path)[1]}"
+
+
+def _symbols_for_blob(repo: Repo, path: str, sha: str) -> list[dict]:
+    def compute():
+        raw = repo.object_store[sha.encode()].as_raw_string()
+        return extract_symbols(path, raw.decode("utf-8", errors="replace"))
+
+    return get_artifact_cache().get_or_compute(_cache_kind(path), sha, compute)
+
+
+def build_symbol_index(agent_path: str) -> SymbolIndex:
+    """Indexes every tracked file from the git index. Per-blob results come from the artifact cache,
+    so files unchanged since another agent indexed them cost nothing."""
+    repo = Repo(agent_path)
+    index = SymbolIndex(agent_path)
+    for raw_path, entry in repo.open_index().items():
+        size = getattr(entry, "size", None)
+        if size is None or size > MAX_INDEXED_FILE_BYTES:
+            continue
+        path = raw_path.decode("utf-8", errors="replace")
+        index.tracked.add(path)
+        if not is_indexable(path):
+            continue
+        try:
+            index.set_file(path, _symbols_for_blob(repo, path, entry.sha.decode()))
+        except Exception as exc:
+            logger.warning("failed to index %s: %s", path, exc)
+    return index
+
+
+_indexes: dict[int, SymbolIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_symbol_index(agent_id: int) -> SymbolIndex | None:
+    with _indexes_lock:
+        if agent_id in _indexes:
+            return _indexes[agent_id]
+    agent_path = get_workspace_path(agent_id)
+    if not os.path.isdir(agent_path):
+        return None
+    index = build_symbol_index(agent_path)
+    with _indexes_lock:
+        return _indexes.setdefault(agent_id, index)
+
+
+def update_symbols(agent_id: int, path: str, content: str):
+    """Re-indexes one file after a write; a no-op until the agent's index has been built."""
+    with _indexes_lock:
+        index = _indexes.get(agent_id)
+    if index is None:
+        return
+    path = os.path.normpath(path)
+    if index.resolve_path(path) is None:
+        return
+    index.tracked.add(path)
+    if is_indexable(path):
+        symbols = extract_symbols(path, content)
+        index.set_file(path, symbols)
+        get_artifact_cache().put(
+            _cache_kind(path),
+            Blob.from_string(content.encode("utf-8")).id.decode(),
+            symbols,
+        )
+
+
+def drop_symbol_index(agent_id: int):
+    with _indexes_lock:
+        _indexes.pop(agent_id, None)
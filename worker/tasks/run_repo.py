@@ -1,13 +1,31 @@
 import asyncio
 from dataclasses import dataclass
 from celery_app import celery_app
+from celery.signals import task_revoked
 import httpx
-import subprocess, os, uuid, logging, json
+import subprocess, os, uuid, logging, json, shutil
 from dulwich import porcelain
 from dotenv import load_dotenv
 from langchain.agents import create_agent
-from tools import grep, list_files, read_file, update_file, load_tools
-from utils import emit_status, emit_error, emit_done, get_stream_client, get_workspace_path
+from langchain_core.messages import AIMessageChunk
+from blobs import inline_or_blob, resolve_field
+from budget import BudgetMiddleware, JobBudget, JobCancelled, JobGuard, clear_cancel, register_task, unregister_task
+from checkpoints import clear_checkpoint, close_checkpointer, get_thread_id, has_checkpoint, open_checkpointer
+from history import compact_history
+from rate_limit import RateLimitMiddleware
+from symbols import drop_symbol_index, get_symbol_index
+from tools import find_definition, find_references, grep, list_files, outline_file, read_file, update_file, load_tools
+from utils import (
+    emit_status,
+    emit_error,
+    emit_done,
+    emit_step,
+    get_stream_client,
+    get_workspace_path,
+    archive_agent_stream,
+    delete_archived_stream,
+    TokenBatcher,
+)
 from posthog import Posthog
 from posthog.ai.langchain import CallbackHandler
 
@@ -43,7 +61,7 @@ def persist_tool_calls_from_redis(agent_id: int, message_id: int):
             event_id_str = event_id if isinstance(event_id, str) else event_id.decode()
             try:
                 timestamp_ms = int(event_id_str.split('-')[0])
-                arguments_raw = fields.get('arguments', '{}')
+                arguments_raw = resolve_field(fields, 'arguments') or '{}'
                 try:
                     arguments = json.loads(arguments_raw) if arguments_raw else {}
                 except json.JSONDecodeError:
@@ -53,7 +71,7 @@ def persist_tool_calls_from_redis(agent_id: int, message_id: int):
                     'timestamp_ms': timestamp_ms,
                     'tool_name': fields.get("step"),
                     'arguments': arguments,
-                    'detail': fields.get('detail', ''),
+                    'detail': resolve_field(fields, 'detail'),
                     'status': fields.get('phase', 'success'),
                 })
             except (TypeError, ValueError):
@@ -72,6 +90,7 @@ def persist_tool_calls_from_redis(agent_id: int, message_id: int):
 def reset_agent_stream(agent_id: int):
     try:
         get_stream_client().delete(f"stream:agent:{agent_id}")
+        delete_archived_stream(agent_id)
     except Exception as exc:
         logger.warning("reset stream error: %s", exc)
 
@@ -157,7 +176,80 @@ includes one or multiple tools. The prompt for each function is styled similarly
 Use these prompts to understand the point of certain included prompts, and how they relate to the user's request.
 """
 
-def _run_agent_session(agent_id: int, docker_id: str, prompt: str, tool_slugs: list[str], previousMessages: list | None = None):
+def _message_text(message) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
+
+
+def _emit_step_messages(agent_id: int, update: dict):
+    for node, node_update in update.items():
+        if not isinstance(node_update, dict):
+            continue
+        for message in node_update.get("messages", []):
+            tool_calls = getattr(message, "tool_calls", None)
+            content, content_blob = inline_or_blob(_message_text(message))
+            emit_step(
+                agent_id,
+                node,
+                message.type,
+                content,
+                content_blob=content_blob,
+                tool_calls=",".join(call["name"] for call in tool_calls) if tool_calls else None,
+            )
+
+
+def _stream_agent(
+    agent,
+    agent_id: int,
+    agent_input: dict | None,
+    context: ToolContext,
+    config: dict,
+    guard: JobGuard | None = None,
+) -> dict:
+    batcher = TokenBatcher(agent_id)
+    final_state = None
+    stream = agent.stream(
+        agent_input,
+        context=context,
+        config=config,
+        stream_mode=["messages", "updates", "values"],
+    )
+    try:
+        for mode, chunk in stream:
+            if guard:
+                guard.check()
+            if mode == "messages":
+                message, metadata = chunk
+                if isinstance(message, AIMessageChunk):
+                    batcher.add(_message_text(message), node=metadata.get("langgraph_node"))
+            elif mode == "updates":
+                batcher.flush()
+                _emit_step_messages(agent_id, chunk)
+            elif mode == "values":
+                final_state = chunk
+    finally:
+        batcher.flush()
+        stream.close()
+    return final_state
+
+
+def _run_agent_session(
+    agent_id: int,
+    docker_id: str,
+    prompt: str,
+    tool_slugs: list[str],
+    previousMessages: list | None = None,
+    checkpointer=None,
+    thread_id: str | None = None,
+    resume: bool = False,
+    guard: JobGuard | None = None,
+):
     dynamic_tools, prompts = asyncio.run(load_tools(tool_slugs, agent_id=agent_id))
     posthog = Posthog(
         (os.environ.get("POSTHOG_API_KEY", "")),
@@ -169,33 +261,63 @@ def _run_agent_session(agent_id: int, docker_id: str, prompt: str, tool_slugs: l
         properties={"agent_id": agent_id},
     )
     
+    # the guard also runs while queued on the rate limiter, so a cancel or the wall-time budget ends the wait
+    middleware = [RateLimitMiddleware(agent_id, check=guard.check if guard else None)]
+    if guard:
+        # outermost, so a cancelled or exhausted job stops before waiting on the rate limiter
+        middleware.insert(0, BudgetMiddleware(guard))
+
     agent = create_agent(
         model="gpt-5-mini",
-        tools=[update_file, grep, list_files, read_file, *dynamic_tools],
+        tools=[
+            update_file,
+            grep,
+            list_files,
+            read_file,
+            find_definition,
+            find_references,
+            outline_file,
+            *dynamic_tools,
+        ],
         system_prompt=AGENT_SYSTEM_PROMPT,
-        context_schema=ToolContext
+        context_schema=ToolContext,
+        middleware=middleware,
+        checkpointer=checkpointer,
     )
-    emit_status(agent_id, "running", step="agent_start", detail="agent execution started")
-
-    messages = [{"role": "user", "content": prompt}]
-
-    if prompts:
-        messages = [
-            {"role": "developer", "content": TOOLS_PROMPT},
-            {"role": "developer", "content": "\n\n\n".join(prompts)}
-        ] + messages
-    if previousMessages:
-        previous_messages_str = json.dumps(previousMessages, default=str)
-        messages.insert(0, {"role": "user", "content": previous_messages_str})
-
-    response = agent.invoke(
-        {"messages": messages},
+    config = {"callbacks": [callback_handler], "configurable": {"agent_id": agent_id, "thread_id": thread_id}}
+
+    if resume:
+        # a None input continues the graph from the last checkpointed step of this thread
+        emit_status(agent_id, "running", step="agent_resume", detail="resuming agent from last checkpoint")
+        agent_input = None
+    else:
+        emit_status(agent_id, "running", step="agent_start", detail="agent execution started")
+
+        # stable prefix first (system prompt, tool prompts, compacted history) so provider prompt caching can hit
+        messages = []
+        if prompts:
+            messages += [
+                {"role": "developer", "content": TOOLS_PROMPT},
+                {"role": "developer", "content": "\n\n\n".join(prompts)}
+            ]
+        if previousMessages:
+            messages += compact_history(agent_id, previousMessages)
+        messages.append({"role": "user", "content": prompt})
+        agent_input = {"messages": messages}
+
+    response = _stream_agent(
+        agent,
+        agent_id,
+        agent_input,
         context=ToolContext(
             agent_id=agent_id,
             docker_name=docker_id,
         ),
-        config={"callbacks": [callback_handler], "configurable": {"agent_id": agent_id}},
+        config=config,
+        guard=guard,
     )
+    if response is None and checkpointer is not None:
+        response = agent.get_state(config).values
     final_message = response["messages"][-1].content
 
     msg_response = httpx.post(
@@ -212,15 +334,40 @@ def _run_agent_session(agent_id: int, docker_id: str, prompt: str, tool_slugs: l
     return {"response": str(response["messages"][-1])}
 
 
-def _run_agent_job(agent_id: int, prompt: str, tool_slugs: list[str], github_repo_name: str | None = None, previous_messages: list | None = None):
+def _run_agent_job(
+    agent_id: int,
+    prompt: str,
+    tool_slugs: list[str],
+    github_repo_name: str | None = None,
+    previous_messages: list | None = None,
+    task_id: str | None = None,
+    budget: dict | None = None,
+    redelivered: bool = False,
+):
     docker_id = str(uuid.uuid4())
-    reset_agent_stream(agent_id)
-    init_detail = "preparing agent workspace" if github_repo_name else "processing agent message"
-    emit_status(agent_id, "starting", step="init", detail=init_detail)
-    update_agent_status(agent_id, "RUNNING")
+    thread_id = get_thread_id(agent_id, task_id)
+    if task_id:
+        register_task(agent_id, task_id)
+    checkpointer = None
     success = False
+    cancelled = False
     try:
-        if github_repo_name:
+        checkpointer = open_checkpointer(agent_id)
+        # a redelivered task (worker restarted or killed mid-run) picks up its own checkpoint and workspace
+        resume = has_checkpoint(checkpointer, thread_id) and getAgentWorkspacePath(agent_id) is not None
+        if not resume:
+            reset_agent_stream(agent_id)
+        guard = JobGuard(agent_id, JobBudget.from_overrides(budget), task_id=task_id)
+        init_detail = "preparing agent workspace" if github_repo_name else "processing agent message"
+        emit_status(agent_id, "starting", step="init", detail="resuming interrupted agent run" if resume else init_detail)
+        update_agent_status(agent_id, "RUNNING")
+
+        # a cancel sent while the task was queued, whose revoke never reached this worker
+        guard.check()
+        if github_repo_name and not resume:
+            if redelivered and (stale_path := getAgentWorkspacePath(agent_id)):
+                # killed before the first checkpoint (mid clone, indexing or mount): start from a clean clone
+                shutil.rmtree(stale_path)
             created_agent_id, branch_name = createAgentWorkspace(github_repo_name, agent_id)
             if not created_agent_id:
                 emit_error(agent_id, "workspace_not_found", "repository not found", step="create_workspace")
@@ -241,6 +388,12 @@ def _run_agent_job(agent_id: int, prompt: str, tool_slugs: list[str], github_rep
                 update_agent_status(agent_id, "FAILED")
                 return {"error": "workspace not initialized"}
 
+        try:
+            get_symbol_index(agent_id)
+        except Exception as exc:
+            logger.warning("failed to build symbol index: %s", exc)
+
+        guard.check()
         if mountAgentToDocker(agent_id, docker_id) < 0:
             emit_error(agent_id, "docker_mount_failed", "docker mount failed", step="mount_workspace")
             update_agent_status(agent_id, "FAILED")
@@ -252,33 +405,82 @@ def _run_agent_job(agent_id: int, prompt: str, tool_slugs: list[str], github_rep
             prompt,
             tool_slugs,
             previous_messages,
+            checkpointer=checkpointer,
+            thread_id=thread_id,
+            resume=resume,
+            guard=guard,
         )
         success = True
         return result
+    except JobCancelled as exc:
+        cancelled = True
+        if task_id:
+            clear_cancel(agent_id, task_id)
+        emit_error(agent_id, exc.code, str(exc))
+        update_agent_status(agent_id, "FAILED")
+        return {"error": str(exc)}
     except Exception as exc:
         emit_error(agent_id, "pipeline_failure", str(exc))
         update_agent_status(agent_id, "FAILED")
         raise
     finally:
-        emit_done(agent_id, "success" if success else "error")
+        emit_done(agent_id, "success" if success else "cancelled" if cancelled else "error")
+        archive_agent_stream(agent_id)
         unmountDocker(docker_id)
+        drop_symbol_index(agent_id)
+        if checkpointer is not None:
+            clear_checkpoint(checkpointer, thread_id)
+            close_checkpointer(checkpointer)
+        if task_id:
+            unregister_task(agent_id, task_id)
 
 
-@celery_app.task(name="tasks.pipeline", bind=True)
-def pipeline(self, github_repo_name: str, prompt: str, agent_id: int, tool_slugs: list[str]):
+@celery_app.task(name="tasks.pipeline", bind=True, acks_late=True, reject_on_worker_lost=True)
+def pipeline(self, github_repo_name: str, prompt: str, agent_id: int, tool_slugs: list[str], budget: dict | None = None):
     return _run_agent_job(
         agent_id=agent_id,
         prompt=prompt,
         github_repo_name=github_repo_name,
         tool_slugs=tool_slugs,
+        task_id=self.request.id,
+        budget=budget,
+        redelivered=bool((self.request.delivery_info or {}).get("redelivered")),
     )
 
 
-@celery_app.task(name="tasks.process_agent_message", bind=True)
-def process_agent_message(self, prompt: str, agent_id: int, previous_messages, tool_slugs: list[str]):
+@celery_app.task(name="tasks.process_agent_message", bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_agent_message(self, prompt: str, agent_id: int, previous_messages, tool_slugs: list[str], budget: dict | None = None):
     return _run_agent_job(
         agent_id=agent_id,
         prompt=prompt,
         previous_messages=previous_messages,
         tool_slugs=tool_slugs,
+        task_id=self.request.id,
+        budget=budget,
+        redelivered=bool((self.request.delivery_info or {}).get("redelivered")),
     )
+
+
+_AGENT_ID_POSITION = {pipeline.name: 2, process_agent_message.name: 1}
+
+
+@task_revoked.connect
+def _on_task_revoked(sender=None, request=None, **kwargs):
+    """A task revoked while still queued is discarded without running _run_agent_job, so nothing
+    else would emit done or move the agent out of PENDING/RUNNING."""
+    # sender is the task object; request is a task Context, which keeps the name in `.task`
+    task_name = getattr(sender, "name", None) or getattr(request, "task", None)
+    if task_name not in _AGENT_ID_POSITION:
+        return
+    args = getattr(request, "args", None) or []
+    agent_id = (getattr(request, "kwargs", None) or {}).get("agent_id")
+    if agent_id is None and len(args) > _AGENT_ID_POSITION[task_name]:
+        agent_id = args[_AGENT_ID_POSITION[task_name]]
+    if agent_id is None:
+        return
+    emit_error(agent_id, "cancelled", "agent cancelled before it started", step="init")
+    update_agent_status(agent_id, "FAILED")
+    emit_done(agent_id, "cancelled")
+    archive_agent_stream(agent_id)
+    clear_cancel(agent_id, request.id)
+    unregister_task(agent_id, request.id)
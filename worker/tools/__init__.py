@@ -4,25 +4,37 @@ import inspect
 import json
 from typing import Any
 
+from .find_definition import find_definition
+from .find_references import find_references
 from .grep import grep
 from .list_files import list_files
+from .outline_file import outline_file
 from .read_file import read_file
 from .update_file import update_file
 
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import StructuredTool
 from mcp.shared.exceptions import McpError
+from blobs import inline_or_blob
 from utils import emit_status
 
-__all__ = ["grep", "list_files", "read_file", "update_file", "load_tools"]
+__all__ = [
+    "find_definition",
+    "find_references",
+    "grep",
+    "list_files",
+    "outline_file",
+    "read_file",
+    "update_file",
+    "load_tools",
+]
 
 
 def _stringify_payload(payload: Any) -> str:
     try:
-        text = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
+        return payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False, default=str)
     except Exception:
-        text = str(payload)
-    return text if len(text) <= 5000 else text[:5000] + "..."
+        return str(payload)
 
 
 def _prepare_arguments_snapshot(args: tuple[Any, ...], kwargs: dict[str, Any]) -> Any:
@@ -40,12 +52,16 @@ def _prepare_result_snapshot(result: Any) -> Any:
 
 def _emit_tool_record(agent_id: int | None, tool_name: str, phase: str, arguments: Any, result: Any):
     if agent_id:
+        detail, detail_blob = inline_or_blob(_stringify_payload(result))
+        arguments_text, arguments_blob = inline_or_blob(_stringify_payload(arguments))
         emit_status(
             agent_id,
             phase,
             step=f"tool_{tool_name}",
-            detail=_stringify_payload(result),
-            arguments=_stringify_payload(arguments),
+            detail=detail,
+            arguments=arguments_text,
+            detail_blob=detail_blob,
+            arguments_blob=arguments_blob,
         )
 
 
@@ -0,0 +1,26 @@
+from langchain.tools import tool, ToolRuntime
+from symbols import get_symbol_index
+from utils import emit_status
+
+MAX_RESULTS = 50
+
+
+@tool
+def find_definition(name: str, runtime: ToolRuntime) -> str:
+    """Find where a function, class, method, variable or type is defined in the codebase.
+    Accepts a bare name (parse) or a qualified name (Parser.parse). Prefer this over grep for definitions."""
+    ctx = runtime.context
+    agent_id = ctx.agent_id
+
+    emit_status(agent_id, "running", step="tool_find_definition", detail=f"definition: {name}")
+
+    index = get_symbol_index(agent_id)
+    if index is None:
+        return "agent workspace not found."
+    matches = index.definitions(name.strip())
+    if not matches:
+        return f"no definition found for '{name}'"
+    lines = [f"{path}:{symbol['line']} {symbol['kind']} {symbol['qualname']}" for path, symbol in matches[:MAX_RESULTS]]
+    if len(matches) > MAX_RESULTS:
+        lines.append(f"... {len(matches) - MAX_RESULTS} more definitions")
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+import re
+from langchain.tools import tool, ToolRuntime
+from symbols import get_symbol_index
+from utils import emit_status
+
+MAX_RESULTS = 100
+
+
+@tool
+def find_references(name: str, runtime: ToolRuntime) -> str:
+    """Find every line in the tracked files of the codebase that mentions a symbol as a whole word.
+    For a qualified name (Parser.parse) the last part is searched."""
+    ctx = runtime.context
+    agent_id = ctx.agent_id
+
+    emit_status(agent_id, "running", step="tool_find_references", detail=f"references: {name}")
+
+    index = get_symbol_index(agent_id)
+    if index is None:
+        return "agent workspace not found."
+    word = name.strip().split(".")[-1]
+    if not word:
+        return "a symbol name is required."
+    pattern = re.compile(rf"(?<![\w$]){re.escape(word)}(?![\w$])")
+
+    results = []
+    total = 0
+    for path in sorted(index.tracked):
+        if (full_path := index.resolve_path(path)) is None:
+            continue
+        try:
+            with open(full_path, encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        if word not in text:
+            continue
+        for lineno, line in enumerate(text.splitlines(), start=1):
+            if pattern.search(line):
+                total += 1
+                if len(results) < MAX_RESULTS:
+                    results.append(f"{path}:{lineno}: {line.strip()[:200]}")
+    if not results:
+        return f"no references found for '{word}'"
+    if total > MAX_RESULTS:
+        results.append(f"... {total - MAX_RESULTS} more references")
+    return "\n".join(results)
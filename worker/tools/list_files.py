@@ -1,17 +1,104 @@
+import os
 import subprocess
+from dulwich.repo import Repo
 from langchain.tools import tool, ToolRuntime
-from utils import emit_status
+from utils import emit_status, get_workspace_path
+
+MAX_LISTING_LINES = 400
+
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+def _build_tree(agent_path: str, prefix: str) -> dict:
+    """Nested {name: subtree | size} built from the git index, so only tracked and staged files
+    appear and anything covered by .gitignore is left out without walking the filesystem."""
+    root: dict = {}
+    for path, entry in Repo(agent_path).open_index().items():
+        size = getattr(entry, "size", None)
+        if size is None:
+            continue
+        path = path.decode("utf-8", errors="replace")
+        if prefix:
+            if not path.startswith(prefix + "/"):
+                continue
+            path = path[len(prefix) + 1:]
+        *dirs, name = path.split("/")
+        node = root
+        for part in dirs:
+            node = node.setdefault(part, {})
+        node[name] = size
+    return root
+
+
+def _summarize(node: dict) -> tuple[int, int]:
+    files, total = 0, 0
+    for child in node.values():
+        if isinstance(child, dict):
+            child_files, child_total = _summarize(child)
+            files += child_files
+            total += child_total
+        else:
+            files += 1
+            total += child
+    return files, total
+
+
+def _render(node: dict, depth: int, max_depth: int, lines: list[str]):
+    indent = "  " * depth
+    for name in sorted(node, key=lambda key: (not isinstance(node[key], dict), key)):
+        child = node[name]
+        if isinstance(child, dict):
+            files, total = _summarize(child)
+            lines.append(f"{indent}{name}/ ({files} files, {_format_size(total)})")
+            if depth + 1 < max_depth:
+                _render(child, depth + 1, max_depth, lines)
+        else:
+            lines.append(f"{indent}{name} {_format_size(child)}")
+
+
+def _list_recursive(agent_id: int, path: str, max_depth: int) -> str:
+    agent_path = get_workspace_path(agent_id)
+    if not os.path.isdir(agent_path):
+        return "agent workspace not found."
+    prefix = path.strip().strip("/")
+    prefix = "" if prefix == "." else prefix.removeprefix("./")
+    tree = _build_tree(agent_path, prefix)
+    if not tree:
+        return f"no tracked files under '{path or '.'}'"
+
+    files, total = _summarize(tree)
+    lines = [f"{prefix or '.'}/ ({files} files, {_format_size(total)})"]
+    _render(tree, 1, max(1, max_depth) + 1, lines)
+    if len(lines) > MAX_LISTING_LINES:
+        hidden = len(lines) - MAX_LISTING_LINES
+        lines = lines[:MAX_LISTING_LINES] + [f"... {hidden} more entries, list a subdirectory or lower max_depth"]
+    return "\n".join(lines)
 
 
 @tool
-def list_files(path: str, runtime: ToolRuntime) -> str:
-    """List files in a given path using ls command. Use empty string or '.' to list root directory."""
+def list_files(path: str, runtime: ToolRuntime, recursive: bool = False, max_depth: int = 3) -> str:
+    """List files in a given path using ls command. Use empty string or '.' to list root directory.
+    Set recursive to true to get a map of the repository in one call: every tracked file below path
+    (gitignored files excluded) up to max_depth directory levels, with file sizes and per-directory
+    file counts and total sizes."""
     ctx = runtime.context
     docker_name = ctx.docker_name
     agent_id = ctx.agent_id
-    
+
     emit_status(agent_id, "running", step="tool_list_files", detail=f"listing: {path if path != '.' else 'root'}")
-    
+
+    if recursive:
+        try:
+            return _list_recursive(agent_id, path, max_depth)
+        except Exception as e:
+            return "error listing files: " + str(e)
+
     cmd = [
         "docker", "exec", docker_name, "sh", "-c", f"cd app && ls {path}"
     ]
@@ -20,4 +107,3 @@ def list_files(path: str, runtime: ToolRuntime) -> str:
         return out.decode("utf-8", errors="replace")
     except subprocess.CalledProcessError as e:
         return "error running ls: " + e.output.decode()
-
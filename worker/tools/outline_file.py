@@ -0,0 +1,35 @@
+import os
+from langchain.tools import tool, ToolRuntime
+from symbols import extract_symbols, get_symbol_index
+from utils import emit_status
+
+
+@tool
+def outline_file(path: str, runtime: ToolRuntime) -> str:
+    """Outline a file: its classes, functions, methods, variables and types with line numbers,
+    without reading the whole file."""
+    ctx = runtime.context
+    agent_id = ctx.agent_id
+
+    emit_status(agent_id, "running", step="tool_outline_file", detail=f"outline: {path}")
+
+    index = get_symbol_index(agent_id)
+    if index is None:
+        return "agent workspace not found."
+    path = os.path.normpath(path)
+    full_path = index.resolve_path(path)
+    if full_path is None:
+        return f"error: {path} is outside the workspace"
+    symbols = index.files.get(path)
+    if symbols is None:
+        try:
+            with open(full_path, encoding="utf-8") as f:
+                symbols = extract_symbols(path, f.read())
+        except (OSError, UnicodeDecodeError) as e:
+            return f"error reading {path}: {e}"
+    if not symbols:
+        return f"no symbols found in {path}"
+    return "\n".join(
+        f"{'  ' * symbol['qualname'].count('.')}{symbol['line']}: {symbol['kind']} {symbol['name']}"
+        for symbol in symbols
+    )
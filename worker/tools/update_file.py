@@ -1,6 +1,7 @@
 import os
 from dulwich.repo import Repo
 from langchain.tools import tool, ToolRuntime
+from symbols import update_symbols
 from utils import emit_status, get_workspace_path
 
 
@@ -22,5 +23,6 @@ def update_file(path: str, content: str, runtime: ToolRuntime) -> str:
     with open(full_path, "w", encoding="utf-8") as f:
         f.write(content)
     repo.get_worktree().stage([path.encode()])
+    update_symbols(agent_id, path, content)
     return "file updated"
 
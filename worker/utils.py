@@ -1,12 +1,15 @@
 import redis
 import os
 import time
+import gzip
+import json
 import logging
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 STREAM_REDIS_URL = os.getenv("STREAM_REDIS_URL", "redis://localhost:6379/2")
+STREAM_HOT_TTL_SECONDS = int(os.getenv("STREAM_HOT_TTL_SECONDS", "3600"))
 _stream_client: Optional[redis.Redis] = None
 
 
@@ -60,6 +63,152 @@ def emit_done(agent_id: int, reason: str):
     publish_stream_event(agent_id, "done", reason=reason)
 
 
+def emit_token(agent_id: int, delta: str, node: str | None = None):
+    publish_stream_event(agent_id, "token", delta=delta, node=node)
+
+
+def emit_step(agent_id: int, node: str, role: str, content: str, **extra_fields):
+    publish_stream_event(
+        agent_id,
+        "step",
+        node=node,
+        role=role,
+        content=content,
+        **{key: value for key, value in extra_fields.items() if value is not None},
+    )
+
+
+class TokenBatcher:
+    """Coalesces model token deltas into small batches before publishing them."""
+
+    def __init__(self, agent_id: int, max_chars: int = 96, max_interval: float = 0.15):
+        self.agent_id = agent_id
+        self.max_chars = max_chars
+        self.max_interval = max_interval
+        self._parts: list[str] = []
+        self._size = 0
+        self._node: str | None = None
+        self._last_flush = time.monotonic()
+
+    def add(self, delta: str, node: str | None = None):
+        if not delta:
+            return
+        if self._parts and node != self._node:
+            self.flush()
+        self._node = node
+        self._parts.append(delta)
+        self._size += len(delta)
+        if self._size >= self.max_chars or time.monotonic() - self._last_flush >= self.max_interval:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            emit_token(self.agent_id, "".join(self._parts), node=self._node)
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+
 def get_workspace_path(agent_id: int) -> str:
     return f"/Users/brandonpieczka/repos/codee/.data/agents/{agent_id}"
 
+
+def get_checkpoint_path(agent_id: int) -> str:
+    return f"/Users/brandonpieczka/repos/codee/.data/checkpoints/{agent_id}.sqlite"
+
+
+def get_stream_archive_path(agent_id: int) -> str:
+    return f"/Users/brandonpieczka/repos/codee/.data/streams/{agent_id}.jsonl.gz"
+
+
+def get_blob_dir() -> str:
+    return "/Users/brandonpieczka/repos/codee/.data/blobs"
+
+
+def get_blob_path(sha: str) -> str:
+    return f"{get_blob_dir()}/{sha[:2]}/{sha}.gz"
+
+
+def get_artifact_cache_dir() -> str:
+    return "/Users/brandonpieczka/repos/codee/.data/artifacts"
+
+
+def evict_lru_files(root: str, max_bytes: int, max_age_seconds: float | None = None):
+    """Deletes files under root last touched more than max_age_seconds ago, then the least recently
+    used (by mtime, which callers bump on every read) until the rest fits in 80% of max_bytes."""
+    entries = []
+    total = 0
+    cutoff = time.time() - max_age_seconds if max_age_seconds else None
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                info = os.stat(path)
+                if cutoff is not None and info.st_mtime < cutoff:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+    if total <= max_bytes:
+        return
+    entries.sort()
+    target = max_bytes * 0.8
+    for _mtime, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def stream_id_key(stream_id: str) -> tuple[int, int]:
+    ms, _, seq = stream_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def archive_agent_stream(agent_id: int):
+    """Moves a finished stream to the archive: token deltas are dropped (step events carry the
+    full messages), the rest is gzipped to disk, and the hot Redis key is left to expire."""
+    stream_key = f"stream:agent:{agent_id}"
+    try:
+        client = get_stream_client()
+        events = client.xrange(stream_key, min="-", max="+")
+        if not events:
+            return
+        path = get_stream_archive_path(agent_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for event_id, fields in events:
+                if fields.get("event") == "token":
+                    continue
+                f.write(json.dumps({"id": event_id, "fields": fields}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        client.expire(stream_key, STREAM_HOT_TTL_SECONDS)
+    except Exception as exc:
+        logger.warning("failed to archive stream: %s", exc)
+
+
+def load_archived_events(agent_id: int, after: str = "0-0") -> list[tuple[str, dict]]:
+    path = get_stream_archive_path(agent_id)
+    if not os.path.isfile(path):
+        return []
+    after_key = stream_id_key(after)
+    events = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if stream_id_key(entry["id"]) > after_key:
+                events.append((entry["id"], entry["fields"]))
+    return events
+
+
+def delete_archived_stream(agent_id: int):
+    path = get_stream_archive_path(agent_id)
+    if os.path.isfile(path):
+        os.remove(path)
+